@@ -0,0 +1,247 @@
+# File: bench/run_bench.py
+# Latency and queries-per-request benchmark for the attendance workflow (see bench/README.md)
+
+import argparse
+import glob
+import http.cookiejar
+import json
+import os
+import platform
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+# Query counts come from the app's own instrumentation, so it must be on before import.
+os.environ.setdefault('METRICS_ENABLED', '1')
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='poddar-bench-metrics-'))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+import app as poddar  # noqa: E402
+
+# (name, role, method, path, form data)
+TARGETS = [
+    ('dashboard', 'manager', 'GET', '/', None),
+    ('manager_dashboard', 'business_manager', 'GET', '/manager_dashboard', None),
+    ('payments', 'manager', 'GET', '/payments', None),
+    ('reports', 'manager', 'GET', '/reports', None),
+    ('employee_dashboard', 'employee', 'GET', '/employee/dashboard', None),
+    ('mark_attendance', 'employee', 'POST', '/mark_attendance', {'event_type': 'Start'}),
+    ('api_monthly_attendance', 'manager', 'GET', '/api/monthly_attendance?month={month}', None),
+]
+# Served from the dashboard fragment cache, so warmed-up requests are only cache hits. These
+# are timed cold (the data generation bumped before each request, as any write does) under
+# their own name, and warm as '<name>_warm'.
+CACHED_TARGETS = {'dashboard', 'manager_dashboard'}
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def bench_users(database):
+    """Returns {role: (user_id, pin)} for the admin, the first seeded manager and employee."""
+    db = sqlite3.connect(database)
+    try:
+        manager = db.execute("SELECT id, pin FROM users WHERE role = 'manager' AND is_active = 1 ORDER BY id LIMIT 1").fetchone()
+        business_manager = db.execute("SELECT id, pin FROM users WHERE role = 'business_manager' AND is_active = 1 ORDER BY id LIMIT 1").fetchone()
+        employee = db.execute("SELECT id, pin FROM users WHERE role = 'employee' AND is_active = 1 AND business_id = (SELECT business_id FROM users WHERE id = ?) ORDER BY id LIMIT 1",
+                              (business_manager[0],)).fetchone()
+    finally:
+        db.close()
+    return {'manager': manager, 'business_manager': business_manager, 'employee': employee}
+
+class TestClientRunner:
+    """Runs requests in-process through the Flask test client."""
+
+    def __init__(self, users):
+        self.queries = []
+        poddar.app.after_request_funcs.setdefault(None, []).append(self._capture_queries)
+        self.clients = {}
+        for role, (user_id, pin) in users.items():
+            client = poddar.app.test_client()
+            client.post('/login', data={'user_id': user_id, 'pin': pin})
+            self.clients[role] = client
+
+    def _capture_queries(self, response):
+        self.queries.append(poddar.g.get('_sql_queries', 0))
+        return response
+
+    def request(self, role, method, path, data):
+        response = self.clients[role].open(path, method=method, data=data)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        poddar.app.after_request_funcs[None].remove(self._capture_queries)
+
+class HttpRunner:
+    """Runs requests against a live server (e.g. a local gunicorn started with METRICS_ENABLED=1)."""
+
+    def __init__(self, base_url, users):
+        self.base_url = base_url.rstrip('/')
+        self.queries = []
+        self.openers = {}
+        for role, (user_id, pin) in users.items():
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            opener.open(self.base_url + '/login', urllib.parse.urlencode({'user_id': user_id, 'pin': pin}).encode())
+            self.openers[role] = opener
+
+    def request(self, role, method, path, data):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        try:
+            with self.openers[role].open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def sql_totals(self, endpoint):
+        """(sum, count) of http_request_sql_queries for an endpoint, read from /metrics."""
+        try:
+            with self.openers['manager'].open(self.base_url + '/metrics') as response:
+                text = response.read().decode()
+        except urllib.error.HTTPError:
+            return None
+        totals = []
+        for suffix in ('sum', 'count'):
+            match = re.search(rf'^http_request_sql_queries_{suffix}{{endpoint="{endpoint}"}} (\S+)$', text, re.M)
+            totals.append(float(match.group(1)) if match else 0.0)
+        return totals
+
+    def close(self):
+        pass
+
+def measure(runner, endpoint, role, method, path, data, iterations, before_each=None):
+    before = runner.sql_totals(endpoint) if isinstance(runner, HttpRunner) else None
+    runner.queries.clear()
+    timings, statuses = [], set()
+    for _ in range(iterations):
+        if before_each:
+            before_each()
+        started = time.perf_counter()
+        statuses.add(runner.request(role, method, path, data))
+        timings.append((time.perf_counter() - started) * 1000)
+    if isinstance(runner, HttpRunner):
+        after = runner.sql_totals(endpoint)
+        queries = (after[0] - before[0]) / max(after[1] - before[1], 1) if before and after else None
+    else:
+        queries = sum(runner.queries) / len(runner.queries) if runner.queries else None
+    return {
+        'requests': iterations,
+        'statuses': sorted(statuses),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'queries_per_request': round(queries, 2) if queries is not None else None,
+    }
+
+def run_targets(runner, iterations, warmup):
+    month = datetime.now(poddar.IST).strftime('%Y-%m')
+    results = {}
+    for name, role, method, path, data in TARGETS:
+        path = path.format(month=month)
+        for _ in range(warmup):
+            runner.request(role, method, path, data)
+        if name in CACHED_TARGETS:
+            results[name] = measure(runner, name, role, method, path, data, iterations, lambda: poddar.bump_generation('data'))
+            results[f'{name}_warm'] = measure(runner, name, role, method, path, data, iterations)
+        else:
+            results[name] = measure(runner, name, role, method, path, data, iterations)
+    for name, result in results.items():
+        print(f"  {name:<24} p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+              f"queries {result['queries_per_request']}  status {result['statuses']}")
+    return results
+
+def seed_size(employees, years):
+    database = os.path.join(tempfile.mkdtemp(prefix='poddar-bench-'), 'business.db')
+    poddar.DATABASE = database
+    poddar._user_cache.clear()
+    poddar._count_cache.clear()
+    poddar._fragment_cache.clear()
+    with poddar.app.app_context():
+        poddar.init_db()
+        counts = poddar.seed_database(poddar.get_db(), businesses=max(1, employees // 40), employees=employees, years=years)
+    return database, counts
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {os.path.basename(previous_path)} ({previous['version']}):")
+    earlier = {size['label']: size for size in previous['sizes']}
+    for size in current['sizes']:
+        base = earlier.get(size['label'])
+        if not base:
+            continue
+        for name, result in size['targets'].items():
+            old = base['targets'].get(name)
+            if not old:
+                continue
+            change = (result['p99_ms'] - old['p99_ms']) / old['p99_ms'] * 100 if old['p99_ms'] else 0
+            flag = '  <-- slower' if change > 20 else ''
+            print(f"  {size['label']:<10} {name:<24} p99 {old['p99_ms']:>8.2f} -> {result['p99_ms']:>8.2f} ms ({change:+.0f}%)  "
+                  f"queries {old['queries_per_request']} -> {result['queries_per_request']}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10:0.25,60:1,200:2', help='Comma-separated employees:years data sizes (test-client mode).')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--url', help='Benchmark a running server instead of the test client; uses its existing data.')
+    parser.add_argument('--database', default=poddar.DATABASE, help='Database the --url server uses (to look up login users).')
+    parser.add_argument('--compare', help="Results file to compare with (default: the latest in bench/results).")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    report = {
+        'version': git_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'mode': 'http' if args.url else 'test_client',
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'iterations': args.iterations,
+        'sizes': [],
+    }
+    if args.url:
+        print(f"Benchmarking {args.url}")
+        # The cold dashboard timings bump the server's data generation, which lives next to its database.
+        poddar.DATABASE = args.database
+        runner = HttpRunner(args.url, bench_users(args.database))
+        report['sizes'].append({'label': 'live', 'targets': run_targets(runner, args.iterations, args.warmup)})
+    else:
+        for size in args.sizes.split(','):
+            employees, years = size.split(':')
+            label = f'{employees}x{years}y'
+            database, counts = seed_size(int(employees), float(years))
+            print(f"{label}: {counts['attendance']} attendance rows, {counts['payments']} payments")
+            runner = TestClientRunner(bench_users(database))
+            try:
+                report['sizes'].append({'label': label, 'seed': counts, 'targets': run_targets(runner, args.iterations, args.warmup)})
+            finally:
+                runner.close()
+
+    previous = args.compare or next(iter(sorted(glob.glob(os.path.join(RESULTS_DIR, '[0-9]*.json')), reverse=True)), None)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{report['version']}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {os.path.relpath(path, ROOT)}")
+    if previous:
+        compare(report, previous)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# File: bench/spike.py
+# Throughput of the 8 a.m. check-in spike against a running server (see bench/README.md)
+
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import sqlite3
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from run_bench import RESULTS_DIR, ROOT, git_version, percentile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STEPS = ('login', 'employee_dashboard', 'upload_photo', 'mark_attendance')
+
+def spike_employees(database, limit):
+    db = sqlite3.connect(database)
+    try:
+        return db.execute("SELECT id, pin FROM users WHERE role = 'employee' AND is_active = 1 ORDER BY id LIMIT ?", (limit,)).fetchall()
+    finally:
+        db.close()
+
+def selfie_bytes():
+    """A phone-sized JPEG, so the server does the same recompression work as for a real selfie."""
+    if Image is None:
+        return None
+    image = Image.effect_noise((1280, 960), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+def trickle(body, seconds, chunks=20):
+    """Yields the upload in pieces over `seconds`, like a phone on a weak mobile connection."""
+    size = -(-len(body) // chunks)
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+        time.sleep(seconds / chunks)
+
+class CheckIn:
+    """One employee's check-in: log in, open the dashboard, upload the selfie, mark Start."""
+
+    def __init__(self, base_url, employee, photo, slow_seconds, arrives_at):
+        self.base_url = base_url
+        self.employee = employee
+        self.photo = photo
+        self.slow_seconds = slow_seconds
+        self.arrives_at = arrives_at
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.timings = {}
+        self.error = None
+
+    def _open(self, step, path, data=None, headers=None):
+        started = time.perf_counter()
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers or {}, method='POST' if data is not None else 'GET')
+        try:
+            with self.opener.open(request, timeout=120) as response:
+                body = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            self.error = f'{step}: {e}'
+            raise
+        finally:
+            self.timings[step] = (time.perf_counter() - started) * 1000
+        return body
+
+    def run(self):
+        time.sleep(max(0, self.arrives_at - time.perf_counter()))
+        user_id, pin = self.employee
+        try:
+            self._open('login', '/login', urllib.parse.urlencode({'user_id': user_id, 'pin': pin}).encode())
+            self._open('employee_dashboard', '/employee/dashboard')
+            form = {'event_type': 'Start'}
+            if self.photo:
+                body = trickle(self.photo, self.slow_seconds) if self.slow_seconds else self.photo
+                reply = self._open('upload_photo', '/upload_photo', body,
+                                   {'Content-Type': 'image/jpeg', 'Content-Length': str(len(self.photo))})
+                form['photo_ref'] = json.loads(reply)['photo']
+            self._open('mark_attendance', '/mark_attendance', urllib.parse.urlencode(form).encode())
+        except (urllib.error.URLError, OSError, ValueError, KeyError):
+            pass
+        return self
+
+def run_spike(base_url, employees, window, concurrency, slow_uploads, slow_seconds):
+    photo = selfie_bytes()
+    started = time.perf_counter()
+    # The slow uploads arrive first, so they are holding the server while everyone else
+    # arrives evenly over `window` seconds.
+    checkins = [CheckIn(base_url, employee, photo, slow_seconds if n < slow_uploads else 0,
+                        started + (0 if n < slow_uploads else window * n / len(employees)))
+                for n, employee in enumerate(employees)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        done = list(pool.map(CheckIn.run, checkins))
+    elapsed = time.perf_counter() - started
+
+    finished = [c for c in done if c.error is None]
+    fast = [c for c in finished if not c.slow_seconds]
+    report = {
+        'checkins': len(checkins),
+        'completed': len(finished),
+        'errors': sorted({c.error for c in done if c.error})[:10],
+        'seconds': round(elapsed, 2),
+        'checkins_per_second': round(len(finished) / elapsed, 2),
+        'requests_per_second': round(sum(len(c.timings) for c in done) / elapsed, 2),
+        'steps': {},
+    }
+    for step in STEPS:
+        samples = [c.timings[step] for c in fast if step in c.timings]
+        if samples:
+            report['steps'][step] = {'p50_ms': round(percentile(samples, 50), 2), 'p99_ms': round(percentile(samples, 99), 2)}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulates the 8 a.m. check-in spike against a running server.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--database', default=os.path.join(ROOT, 'data', 'business.db'), help='Database the server uses (to look up employees).')
+    parser.add_argument('--employees', type=int, default=200, help='How many employees check in.')
+    parser.add_argument('--window', type=float, default=10.0, help='Seconds over which they arrive.')
+    parser.add_argument('--concurrency', type=int, default=100, help='Most check-ins in flight at once.')
+    parser.add_argument('--slow-uploads', type=int, default=5, help='How many of them upload over a slow connection.')
+    parser.add_argument('--slow-seconds', type=float, default=10.0, help='How long each slow upload takes.')
+    parser.add_argument('--label', default=os.environ.get('GUNICORN_WORKER_CLASS', 'server'), help='Name for this run in the results file.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    employees = spike_employees(args.database, args.employees)
+    if not employees:
+        parser.error(f'{args.database} has no active employees; run `flask seed` first.')
+    if Image is None:
+        print('Pillow is not installed; checking in without selfies.')
+    print(f"Spike: {len(employees)} check-ins over {args.window:.0f}s, {args.slow_uploads} slow uploads ({args.slow_seconds:.0f}s) against {args.url}")
+    result = run_spike(args.url.rstrip('/'), employees, args.window, args.concurrency, args.slow_uploads, args.slow_seconds)
+    print(f"  {result['completed']}/{result['checkins']} check-ins in {result['seconds']}s: "
+          f"{result['checkins_per_second']} check-ins/s, {result['requests_per_second']} requests/s")
+    for step, timing in result['steps'].items():
+        print(f"  {step:<20} p50 {timing['p50_ms']:>8.2f} ms  p99 {timing['p99_ms']:>8.2f} ms")
+    for error in result['errors']:
+        print(f"  error: {error}")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        report = {'version': git_version(), 'timestamp': datetime.now().isoformat(timespec='seconds'), 'mode': 'spike',
+                  'label': args.label, 'url': args.url, 'window': args.window, 'concurrency': args.concurrency, 'slow_uploads': args.slow_uploads,
+                  'slow_seconds': args.slow_seconds, **result}
+        path = os.path.join(RESULTS_DIR, f"spike-{datetime.now():%Y%m%d-%H%M%S}-{args.label}-{report['version']}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {os.path.relpath(path, ROOT)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# File: gunicorn.conf.py
+# Gunicorn settings for Poddar Enterprise (used by startup.sh)
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 3))
+# gthread workers serve several requests per process, so a few slow photo uploads no longer
+# hold every worker. SQLite releases the GIL while it works and each thread checks out its
+# own pooled connection (see get_db), so threads are safe here. 'sync' restores the old mode
+# (gunicorn quietly switches sync workers to gthread when threads > 1); live dashboard
+# streams are then off and the dashboards reload every DASHBOARD_REFRESH_SECONDS instead.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+# Import app.py once in the master and fork the workers from it. The master opens no
+# database connections, so respawned workers start with clean SQLite state.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# Trust the reverse proxy's X-Forwarded-* headers
+forwarded_allow_ips = '*'
+
+def post_fork(server, worker):
+    # Every worker runs a scheduler and the scheduler lease in app.py picks the one that
+    # runs jobs. The master never starts one: its jobs would keep SQLite connections open
+    # there, and every worker respawned later would fork with those handles.
+    from app import app, start_scheduler
+    start_scheduler()
+    # Live dashboard streams each hold a thread, so the app caps them below this (none for sync workers).
+    from gunicorn.workers.gthread import ThreadWorker
+    app.config['WORKER_THREADS'] = server.cfg.threads if isinstance(worker, ThreadWorker) else 1
+
+def child_exit(server, worker):
+    # Runs in the master whenever a worker exits (restart, timeout, crash): its metrics
+    # snapshot must not keep being summed into /metrics.
+    from app import discard_worker_metrics
+    discard_worker_metrics(worker.pid)
@@ -1,18 +1,14 @@
 -- File: schema.sql
--- Defines the database structure for Poddar Enterprise
+-- Baseline database structure for Poddar Enterprise (migration 0001).
+-- Later schema changes are numbered migrations in app.py, applied by `flask migrate`.
 
-DROP TABLE IF EXISTS users;
-DROP TABLE IF EXISTS businesses;
-DROP TABLE IF EXISTS attendance;
-DROP TABLE IF EXISTS payments;
-
-CREATE TABLE businesses (
+CREATE TABLE IF NOT EXISTS businesses (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 name TEXT NOT NULL UNIQUE,
 color TEXT DEFAULT '#cccccc'
 );
 
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 name TEXT NOT NULL,
 phone TEXT,
@@ -24,7 +20,7 @@ is_active INTEGER NOT NULL DEFAULT 1, -- 1 for active, 0 for terminated
 FOREIGN KEY (business_id) REFERENCES businesses (id)
 );
 
-CREATE TABLE attendance (
+CREATE TABLE IF NOT EXISTS attendance (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 employee_id INTEGER NOT NULL,
 timestamp DATETIME NOT NULL,
@@ -37,7 +33,7 @@ rejection_reason TEXT,
 FOREIGN KEY (employee_id) REFERENCES users (id)
 );
 
-CREATE TABLE payments (
+CREATE TABLE IF NOT EXISTS payments (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 employee_id INTEGER NOT NULL,
 amount REAL NOT NULL,
@@ -1,20 +1,16 @@
 #!/bin/sh
-# This script ensures the database is initialized before starting the server.
+# This script ensures the database schema is up to date before starting the server.
 
 # Navigate to the app directory
 cd /app
 
-# --- FIX: Only initialize the database if it doesn't exist ---
-DB_FILE="/app/data/business.db"
-if [ ! -f "$DB_FILE" ]; then
-    echo "Database not found. Initializing..."
-    flask initdb
-    echo "Database initialization complete."
-else
-    echo "Database already exists. Skipping initialization."
-fi
+# Creates the database on first boot and applies any pending numbered migrations.
+# Migrations are idempotent and backfill in small batches, so this is safe on every boot.
+echo "Applying database migrations..."
+flask migrate
+echo "Database migrations complete."
 
 # Start the Gunicorn server
 echo "Starting Gunicorn..."
-# THE FIX: Added --forwarded-allow-ips="*" to trust proxy headers
-exec gunicorn --workers 3 --bind 0.0.0.0:5000 --forwarded-allow-ips="*" app:app
+# Worker class, counts, timeouts and preloading come from GUNICORN_* variables (see gunicorn.conf.py)
+exec gunicorn --config gunicorn.conf.py app:app
@@ -1,5 +1,5 @@
 // File: static/sw.js
-const CACHE_NAME = 'poddar-ent-cache-v3'; // Bumped version to ensure update
+const CACHE_NAME = 'poddar-ent-cache-v4'; // Bumped version to ensure update
 const urlsToCache = [
   '/',
   '/login',
@@ -10,6 +10,106 @@ const urlsToCache = [
   'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/bootstrap-icons.css'
 ];
 
+// --- Offline attendance queue ---
+// Check-ins and notes posted while offline are kept in IndexedDB (photos as Blobs) and
+// replayed in one batch to /api/sync_attendance by Background Sync, or by the page on load
+// and when the connection returns on browsers without Background Sync.
+const QUEUE_DB = 'poddar-offline';
+const QUEUE_STORE = 'attendance-queue';
+const SYNC_TAG = 'attendance-sync';
+const QUEUED_PATHS = ['/mark_attendance', '/add_note'];
+
+function openQueue() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(QUEUE_DB, 1);
+    request.onupgradeneeded = () => request.result.createObjectStore(QUEUE_STORE, { keyPath: 'key' });
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function withQueue(mode, work) {
+  return openQueue().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(QUEUE_STORE, mode);
+    const request = work(tx.objectStore(QUEUE_STORE));
+    tx.oncomplete = () => resolve(request ? request.result : undefined);
+    tx.onerror = () => reject(tx.error);
+  }));
+}
+
+async function enqueue(request) {
+  const form = await request.formData();
+  const isNote = new URL(request.url).pathname === '/add_note';
+  const item = {
+    key: self.crypto.randomUUID(),
+    type: isNote ? 'note' : form.get('event_type'),
+    client_time: new Date().toISOString(),
+    notes: isNote ? form.get('notes') : undefined,
+    photo_ref: form.get('photo_ref') || undefined
+  };
+  const photo = form.get('photo');
+  if (!item.photo_ref && photo && photo.startsWith('data:image')) {
+    item.photo = await (await fetch(photo)).blob();
+  }
+  await withQueue('readwrite', store => store.put(item));
+  if (self.registration.sync) {
+    try { await self.registration.sync.register(SYNC_TAG); } catch (err) { /* replayed by the page instead */ }
+  }
+}
+
+let replaying = null;
+
+function replayQueue() {
+  // One replay at a time; the server also drops repeated idempotency keys.
+  replaying = replaying || doReplay().finally(() => { replaying = null; });
+  return replaying;
+}
+
+async function doReplay() {
+  const items = await withQueue('readonly', store => store.getAll());
+  if (!items.length) return;
+  const events = [];
+  for (const item of items) {
+    const event = { key: item.key, type: item.type, client_time: item.client_time, notes: item.notes, photo_ref: item.photo_ref };
+    if (item.photo && !item.photo_ref) {
+      const body = new FormData();
+      body.append('photo', item.photo, 'photo.jpg');
+      const response = await fetch('/upload_photo', { method: 'POST', body: body, credentials: 'same-origin' });
+      if (response.ok) event.photo_ref = (await response.json()).photo;
+    }
+    events.push(event);
+  }
+  const response = await fetch('/api/sync_attendance', {
+    method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ events: events }), credentials: 'same-origin'
+  });
+  if (!response.ok) throw new Error(`Attendance sync failed with ${response.status}`);
+  const { results } = await response.json();
+  await withQueue('readwrite', store => { results.forEach(result => store.delete(result.key)); });
+}
+
+async function postOrQueue(request) {
+  const queued = request.clone();
+  try {
+    await replayQueue().catch(() => {}); // keep queued events ahead of this one
+    return await fetch(request);
+  } catch (err) {
+    await enqueue(queued);
+    return Response.redirect('/employee/dashboard?queued=1', 303);
+  }
+}
+
+self.addEventListener('sync', event => {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(replayQueue());
+  }
+});
+
+self.addEventListener('message', event => {
+  if (event.data === 'replay-attendance') {
+    event.waitUntil(replayQueue().catch(err => console.log('Attendance replay postponed:', err)));
+  }
+});
+
 // Install event: opens a cache and adds the assets to it
 self.addEventListener('install', event => {
   event.waitUntil(
@@ -39,8 +139,14 @@ self.addEventListener('activate', event => {
 
 // --- THE FIX: Updated Fetch Event to handle redirects properly ---
 self.addEventListener('fetch', event => {
-  // We only want to handle GET requests
+  if (event.request.method === 'POST' && QUEUED_PATHS.includes(new URL(event.request.url).pathname)) {
+    event.respondWith(postOrQueue(event.request));
+    return;
+  }
+  // Everything else: only GET requests are handled
   if (event.request.method !== 'GET') { return; }
+  // The live dashboard stream never ends, so it must not be copied into the cache.
+  if (event.request.headers.get('Accept') === 'text/event-stream') { return; }
 
   event.respondWith(
     fetch(event.request)
@@ -59,8 +165,8 @@ self.addEventListener('fetch', event => {
         return response;
       })
       .catch(() => {
-        // Network request failed, try to get it from the cache.
-        return caches.match(event.request);
+        // Network request failed, try to get it from the cache (ignoring ?queued=1 and similar).
+        return caches.match(event.request, { ignoreSearch: event.request.mode === 'navigate' });
       })
   );
 });
@@ -0,0 +1,57 @@
+# File: tests/conftest.py
+# Shared fixtures for the behaviour tests: a freshly migrated database per test and helpers
+# that create businesses, employees and worked days through the app's own functions.
+
+import os
+import sys
+from datetime import datetime, time, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as app_module  # noqa: E402
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'DATABASE', str(tmp_path / 'business.db'))
+    # Per-process caches are keyed by ids that every fresh database reuses.
+    for cache in (app_module._user_cache, app_module._count_cache, app_module._fragment_cache):
+        cache.clear()
+    with app_module.app.app_context():
+        app_module.init_db()
+        yield app_module.get_db()
+
+@pytest.fixture
+def client(db):
+    return app_module.app.test_client()
+
+def login(client, user_id, role):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['role'] = role
+
+def add_business(db, name='Business'):
+    """Creates a business with one business manager; returns (business_id, manager_id)."""
+    business_id = db.execute('INSERT INTO businesses (name) VALUES (?)', (name,)).lastrowid
+    manager_id = db.execute("INSERT INTO users (name, role, pin, business_id) VALUES (?, 'business_manager', '1111', ?)",
+                            (f'{name} Manager', business_id)).lastrowid
+    db.commit()
+    return business_id, manager_id
+
+def add_employee(db, business_id, daily_wage=500, name='Employee'):
+    employee_id = db.execute("INSERT INTO users (name, role, pin, daily_wage, business_id) VALUES (?, 'employee', '1111', ?, ?)",
+                             (name, daily_wage, business_id)).lastrowid
+    db.commit()
+    return employee_id
+
+def ist_moment(day_str, hour, minute=0):
+    day = datetime.strptime(day_str, '%Y-%m-%d').date()
+    return app_module.IST.localize(datetime.combine(day, time(hour, minute))).astimezone(app_module.pytz.utc)
+
+def work_day(db, employee_id, day_str, hours=9):
+    """Records a pending Start at 09:00 IST and an End `hours` later; returns both attendance ids."""
+    start = ist_moment(day_str, 9)
+    ids = [app_module.record_attendance(db, employee_id, 'Start', start),
+           app_module.record_attendance(db, employee_id, 'End', start + timedelta(hours=hours))]
+    db.commit()
+    return ids
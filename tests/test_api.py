@@ -0,0 +1,64 @@
+# File: tests/test_api.py
+# Behaviour tests for the JSON APIs the service worker and the manager dashboard call.
+
+from datetime import datetime, timedelta
+
+from conftest import add_business, add_employee, app_module, login, work_day
+
+def attendance_count(db):
+    return db.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+
+def test_sync_replay_of_an_idempotency_key_inserts_nothing(db, client):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id)
+    login(client, employee_id, 'employee')
+    client_time = (datetime.now(app_module.pytz.utc) - timedelta(minutes=5)).isoformat()
+    events = {'events': [{'key': 'phone-1:42', 'type': 'Start', 'client_time': client_time}]}
+
+    first = client.post('/api/sync_attendance', json=events).get_json()
+    assert first['accepted'] == 1 and first['results'][0]['status'] == 'ok'
+    assert attendance_count(db) == 1
+
+    replay = client.post('/api/sync_attendance', json=events).get_json()
+    assert replay == {'accepted': 0, 'results': [{'key': 'phone-1:42', 'status': 'duplicate'}]}
+    assert attendance_count(db) == 1
+    assert db.execute('SELECT COUNT(*) FROM sync_receipts').fetchone()[0] == 1
+
+def test_sync_rejects_bodies_that_are_not_an_events_object(db, client):
+    business_id, _ = add_business(db)
+    login(client, add_employee(db, business_id), 'employee')
+    for body in ([{'key': 'a'}], 'events', {'events': {'key': 'a'}}):
+        assert client.post('/api/sync_attendance', json=body).status_code == 400
+    assert attendance_count(db) == 0
+
+def statuses(db, ids):
+    placeholders = ','.join('?' * len(ids))
+    return {r['id']: r['attendance_status'] for r in db.execute(f'SELECT id, attendance_status FROM attendance WHERE id IN ({placeholders})', ids)}
+
+def test_review_refuses_attendance_of_another_business(db, client):
+    own_business, manager_id = add_business(db, 'Own')
+    other_business, _ = add_business(db, 'Other')
+    other_employee = add_employee(db, other_business)
+    own = work_day(db, add_employee(db, own_business), '2025-03-03')
+    other = work_day(db, other_employee, '2025-03-03')
+    login(client, manager_id, 'business_manager')
+
+    reply = client.post('/api/attendance/review', json={'action': 'reject', 'reason': 'Not ours', 'ids': own[:1] + other})
+    assert reply.status_code == 200
+    assert (reply.get_json()['updated'], reply.get_json()['skipped']) == (1, 2)
+    client.post('/api/attendance/review', json={'action': 'approve', 'employee_id': other_employee})
+    client.post(f'/approve_attendance/{other[0]}')
+    client.post(f'/reject_attendance/{other[1]}', data={'rejection_reason': 'Not ours'})
+    client.post('/approve_all_pending')
+
+    assert statuses(db, own) == {own[0]: 'rejected', own[1]: 'approved'}
+    assert statuses(db, other) == dict.fromkeys(other, 'pending')
+    assert app_module.verify_wage_ledger(db) == []
+
+def test_review_rejects_malformed_bodies(db, client):
+    business_id, manager_id = add_business(db)
+    ids = work_day(db, add_employee(db, business_id), '2025-03-03')
+    login(client, manager_id, 'business_manager')
+    for body in (ids, {'action': 'reject', 'reason': ['x'], 'ids': ids}, {'action': 'approve', 'ids': [True]}, {'action': 'approve', 'ids': 'all'}):
+        assert client.post('/api/attendance/review', json=body).status_code == 400
+    assert statuses(db, ids) == dict.fromkeys(ids, 'pending')
@@ -0,0 +1,33 @@
+# File: tests/test_pagination.py
+# Keyset pagination: walking the report pages older and then newer again must visit the
+# rows in exactly the ORDER BY sequence, including rows that share a timestamp.
+
+from datetime import timedelta
+
+from conftest import add_business, add_employee, app_module, ist_moment
+
+def page(db, **cursor):
+    with app_module.app.test_request_context('/reports', query_string=cursor):
+        return app_module.keyset_page(db, 'a.id', 'attendance a', '1 = 1', ())
+
+def test_keyset_pages_walk_the_order_by_sequence_both_ways(db):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id)
+    start = ist_moment('2025-03-03', 9)
+    for n in range(37):
+        # Groups of three rows share a timestamp, so the id tie-breaker decides their order.
+        app_module.record_attendance(db, employee_id, 'Start', start + timedelta(hours=n // 3))
+    db.commit()
+    expected = [r['id'] for r in db.execute('SELECT id FROM attendance ORDER BY timestamp DESC, id DESC')]
+    per_page = app_module.app.config['ITEMS_PER_PAGE']
+
+    pages = [page(db)]
+    while pages[-1]['older']:
+        pages.append(page(db, after=pages[-1]['older']))
+    assert [[r['id'] for r in p['rows']] for p in pages] == [expected[i:i + per_page] for i in range(0, len(expected), per_page)]
+    assert pages[0]['newer'] is None
+
+    walked_back = [pages[-1]]
+    while walked_back[-1]['newer']:
+        walked_back.append(page(db, before=walked_back[-1]['newer']))
+    assert [[r['id'] for r in p['rows']] for p in reversed(walked_back)] == [[r['id'] for r in p['rows']] for p in pages]
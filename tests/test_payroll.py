@@ -0,0 +1,147 @@
+# File: tests/test_payroll.py
+# Behaviour tests for the incremental wage ledger: after every kind of change the stored
+# balances must match a full replay of the attendance and payment history.
+
+import os
+from datetime import datetime
+
+import pytest
+
+from conftest import add_business, add_employee, app_module, ist_moment, work_day
+
+def balance(db, employee_id):
+    return app_module.calculate_employee_balance(db, employee_id)
+
+def test_ledger_matches_replay_after_approve_reject_wage_edit_and_payment(db):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id, daily_wage=500)
+    full_day = work_day(db, employee_id, '2025-01-06')
+    half_day = work_day(db, employee_id, '2025-01-07', hours=3)
+    rejected_day = work_day(db, employee_id, '2025-01-08')
+    assert balance(db, employee_id)['amount_due'] == 0  # nothing is earned while pending
+
+    app_module.review_attendance(db, business_id, 'approved', ids=full_day + half_day + rejected_day)
+    db.commit()
+    assert balance(db, employee_id)['earned_wages'] == pytest.approx(1250)
+    assert app_module.verify_wage_ledger(db) == []
+
+    app_module.review_attendance(db, business_id, 'rejected', 'Not on site', ids=rejected_day[1:])
+    db.commit()
+    assert balance(db, employee_id)['earned_wages'] == pytest.approx(750)
+    assert app_module.verify_wage_ledger(db) == []
+
+    db.execute('UPDATE users SET daily_wage = 600 WHERE id = ?', (employee_id,))
+    app_module.sync_employee_wage(db, employee_id)
+    db.commit()
+    assert balance(db, employee_id)['earned_wages'] == pytest.approx(900)
+    assert app_module.verify_wage_ledger(db) == []
+
+    app_module.record_payment(db, employee_id, 400, 'Wages Paid', '2025-01-10', None)
+    db.commit()
+    assert balance(db, employee_id) == pytest.approx({'earned_wages': 900, 'total_paid': 400, 'amount_due': 500})
+    assert app_module.verify_wage_ledger(db) == []
+
+def test_rebuild_reproduces_the_incremental_ledger(db):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id, daily_wage=450)
+    ids = work_day(db, employee_id, '2025-02-03') + work_day(db, employee_id, '2025-02-04', hours=4)
+    app_module.review_attendance(db, business_id, 'approved', ids=ids)
+    app_module.record_payment(db, employee_id, 100, 'Advance', '2025-02-05', None)
+    db.commit()
+    incremental = balance(db, employee_id)
+
+    app_module.rebuild_wage_ledger(db)
+    assert balance(db, employee_id) == pytest.approx(incremental)
+    assert app_module.verify_wage_ledger(db) == []
+
+def test_close_refuses_a_period_that_is_still_running(db):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id)
+    app_module.review_attendance(db, business_id, 'approved', ids=work_day(db, employee_id, app_module.current_work_date()))
+    db.commit()
+    with pytest.raises(app_module.PayrollError, match='not over yet'):
+        app_module.close_payroll_period(db)
+    assert app_module.closed_through(db) is None
+
+def test_close_refuses_a_period_with_pending_attendance(db):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id)
+    app_module.review_attendance(db, business_id, 'approved', ids=work_day(db, employee_id, '2025-01-06'))
+    work_day(db, employee_id, '2025-01-07')
+    with pytest.raises(app_module.PayrollError, match='pending review'):
+        app_module.close_payroll_period(db)
+
+def test_closed_snapshot_stays_fixed_after_a_wage_change(db):
+    business_id, _ = add_business(db)
+    employee_id = add_employee(db, business_id, daily_wage=500)
+    ids = work_day(db, employee_id, '2025-01-06') + work_day(db, employee_id, '2025-01-07') + work_day(db, employee_id, '2025-02-03')
+    app_module.review_attendance(db, business_id, 'approved', ids=ids)
+    app_module.record_payment(db, employee_id, 300, 'Wages Paid', '2025-01-20', None)
+    db.commit()
+
+    period = app_module.close_payroll_period(db)
+    db.commit()
+    assert (period['period_start'], period['period_end']) == ('2025-01-01', '2025-01-31')
+    snapshot = dict(app_module.payroll_history(db, employee_id)[0])
+    assert snapshot == pytest.approx({'period_start': '2025-01-01', 'period_end': '2025-01-31', 'days_worked': 2, 'wage_rate': 500,
+                                      'earned': 1000, 'paid': 300, 'carried_forward': 700})
+
+    db.execute('UPDATE users SET daily_wage = 800 WHERE id = ?', (employee_id,))
+    app_module.sync_employee_wage(db, employee_id)
+    db.commit()
+    assert dict(app_module.payroll_history(db, employee_id)[0]) == snapshot
+    # January stays at 500 a day; only February's open day is re-priced.
+    assert balance(db, employee_id) == pytest.approx({'earned_wages': 1800, 'total_paid': 300, 'amount_due': 1500})
+    assert app_module.verify_wage_ledger(db) == []
+
+    with pytest.raises(app_module.PayrollError, match='closed'):
+        app_module.record_payment(db, employee_id, 100, 'Wages Paid', '2025-01-31', None)
+    with pytest.raises(app_module.PayrollError, match='closed'):
+        work_day(db, employee_id, '2025-01-08')
+
+@pytest.mark.parametrize('payments', [False, True])
+def test_archiving_a_year_keeps_balances_and_the_ledger_verified(db, payments):
+    year = datetime.now(app_module.IST).year - 1 - app_module.app.config['ARCHIVE_KEEP_YEARS']
+    business_id, _ = add_business(db)
+    employees = [add_employee(db, business_id, daily_wage=wage, name=f'Employee {wage}') for wage in (400, 650)]
+    for employee_id in employees:
+        ids = work_day(db, employee_id, f'{year}-11-03') + work_day(db, employee_id, f'{year}-12-01', hours=4) + work_day(db, employee_id, f'{year + 1}-01-05')
+        app_module.review_attendance(db, business_id, 'approved', ids=ids)
+        app_module.record_payment(db, employee_id, 250, 'Wages Paid', f'{year}-12-15', None)
+    db.commit()
+    while app_module.next_payroll_period(db)[1] <= f'{year}-12-31':
+        app_module.close_payroll_period(db)
+        db.commit()
+    before = app_module.calculate_bulk_balances(db)
+
+    counts = app_module.archive_year(db, year, payments=payments)
+    assert counts['attendance'] == 8 and counts.get('payments', 0) == (2 if payments else 0)
+    assert os.path.exists(app_module.archive_path(year))
+    assert db.execute('SELECT COUNT(*) FROM attendance WHERE work_date <= ?', (f'{year}-12-31',)).fetchone()[0] == 0
+    assert app_module.calculate_bulk_balances(db) == pytest.approx(before)
+    assert app_module.verify_wage_ledger(db) == []
+    with app_module.archive_source(db, 'attendance', [year]) as source:
+        assert db.execute(f'SELECT COUNT(*) FROM {source}').fetchone()[0] == 12
+
+def test_work_date_migration_records_the_balances_it_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'DATABASE', str(tmp_path / 'business.db'))
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        # A database as the baseline left it: schema.sql only, days split at UTC midnight.
+        app_module.migrate_baseline(db)
+        db.executescript("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at DATETIME NOT NULL);"
+                         "INSERT INTO schema_version VALUES (1, 'baseline schema', '2025-01-01');")
+        business_id, _ = add_business(db)
+        night, day = add_employee(db, business_id, 500, 'Night'), add_employee(db, business_id, 400, 'Day')
+        shifts = [(night, ist_moment('2025-01-06', 4), ist_moment('2025-01-06', 13)),  # crosses 05:30 IST
+                  (day, ist_moment('2025-01-06', 9), ist_moment('2025-01-06', 18))]
+        for employee_id, start, end in shifts:
+            db.executemany("INSERT INTO attendance (employee_id, timestamp, event_type, details, attendance_status) VALUES (?, ?, ?, ?, 'approved')",
+                           [(employee_id, start, 'Start', ''), (employee_id, end, 'End', 'Full Day')])
+        db.commit()
+
+        app_module.migrate_db(db)
+        changes = [dict(r) for r in db.execute('SELECT employee_id, utc_days, ist_days, amount_change FROM work_date_changes')]
+        assert changes == [{'employee_id': night, 'utc_days': 0, 'ist_days': 1, 'amount_change': 500}]
+        assert app_module.calculate_employee_balance(db, night)['amount_due'] == 500
+        assert app_module.calculate_employee_balance(db, day)['amount_due'] == 400
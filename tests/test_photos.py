@@ -0,0 +1,44 @@
+# File: tests/test_photos.py
+# The photo store is keyed by the sha256 of the upload; the file name's extension must
+# match what is on disk once processing is done.
+
+import hashlib
+import io
+
+import pytest
+
+from conftest import app_module
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+@pytest.fixture
+def upload_folder(db, tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app_module, '_photo_pool', {'pid': None, 'executor': None})
+    return tmp_path
+
+def store(db, data):
+    """Stores an upload and waits for its background processing."""
+    path = app_module.store_photo(db, io.BytesIO(data))
+    app_module.photo_executor().shutdown(wait=True)
+    app_module._photo_pool['pid'] = None
+    return path
+
+def test_png_keeps_its_extension_without_pillow(db, upload_folder, monkeypatch):
+    monkeypatch.setattr(app_module, 'Image', None)
+    path = store(db, PNG)
+    assert path == app_module.sharded_photo_path(hashlib.sha256(PNG).hexdigest(), 'png')
+    assert app_module.stored_photo(db, path) == path
+    with open(app_module.photo_file(path), 'rb') as f:
+        assert f.read() == PNG
+    # The same bytes uploaded again map to the same file.
+    assert store(db, PNG) == path
+
+@pytest.mark.skipif(app_module.Image is None, reason='needs Pillow')
+def test_uploads_are_re_encoded_to_the_jpg_they_are_named(db, upload_folder):
+    upload = io.BytesIO()
+    app_module.Image.new('RGB', (64, 48), 'red').save(upload, 'PNG')
+    path = store(db, upload.getvalue())
+    assert path == app_module.sharded_photo_path(hashlib.sha256(upload.getvalue()).hexdigest())
+    with open(app_module.photo_file(path), 'rb') as f:
+        assert f.read(3) == b'\xff\xd8\xff'
@@ -0,0 +1,34 @@
+# File: tests/test_query_plans.py
+# EXPLAIN QUERY PLAN regression test: every hot query must use its expected index, both on a
+# freshly migrated database (no statistics) and on a seeded one after the nightly ANALYZE.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as app_module  # noqa: E402
+
+PLANS = app_module.HOT_QUERY_PLANS
+
+@pytest.fixture(scope='module', params=['migrated', 'seeded'])
+def db(request, tmp_path_factory):
+    database = str(tmp_path_factory.mktemp(request.param) / 'business.db')
+    previous, app_module.DATABASE = app_module.DATABASE, database
+    try:
+        with app_module.app.app_context():
+            app_module.init_db()
+            if request.param == 'seeded':
+                result = app_module.app.test_cli_runner().invoke(
+                    args=['seed', '--businesses', '3', '--employees', '30', '--years', '0.5', '--yes'])
+                assert result.exit_code == 0, result.output
+                app_module.refresh_query_statistics(app_module.get_db())
+            yield app_module.get_db()
+    finally:
+        app_module.DATABASE = previous
+
+@pytest.mark.parametrize('name, sql, params, indexes', PLANS, ids=[entry[0] for entry in PLANS])
+def test_hot_query_uses_expected_index(db, name, sql, params, indexes):
+    plan, problem = app_module.query_plan_problem(db, sql, params, indexes)
+    assert problem is None, f"{name} {problem}: {' | '.join(plan)}"